@@ -657,7 +657,8 @@ def get_default_dataloader(
         num_workers=cfg.n_workers,
         persistent_workers=cfg.n_workers > 0,
         shuffle=False,
-        pin_memory=False,
+        # Pinned batches let worker_fn copy images to the GPU asynchronously while workers prepare the next batch.
+        pin_memory=cfg.device == "cuda" and torch.cuda.is_available(),
     )
     return dataloader
 
@@ -902,7 +903,7 @@ def worker_fn(cfg: config.Activations):
     # Calculate and write ViT activations.
     with torch.inference_mode():
         for batch in helpers.progress(dataloader, total=n_batches):
-            images = batch.pop("image").to(cfg.device)
+            images = batch.pop("image").to(cfg.device, non_blocking=True)
             # cache has shape [batch size, n layers, n patches + 1, d vit]
             out, cache = vit(images)
             del out
@@ -1,6 +1,9 @@
+import atexit
 import base64
+import collections
 import concurrent.futures
 import functools
+import hashlib
 import json
 import logging
 import math
@@ -19,7 +22,7 @@ import torch
 from jaxtyping import Float, Int, jaxtyped
 from torch import Tensor
 
-from .. import activations, nn
+from .. import activations, helpers, nn
 from . import data, modeling
 
 log_format = "[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s"
@@ -45,10 +48,41 @@ DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 CWD = pathlib.Path(".")
 
+THUMBS_DPATH = CWD / "thumbs"
+"""Precomputed base64 example images; see `data.precompute_thumbnails`."""
+
 MODEL_LOOKUP = modeling.get_model_lookup()
 
 COLORMAP = matplotlib.colormaps.get_cmap("plasma")
 
+WEBP_POOL = concurrent.futures.ThreadPoolExecutor(
+    max_workers=16, thread_name_prefix="webp"
+)
+"""Long-lived thread pool for webp encoding (and other background I/O), shared across requests."""
+atexit.register(WEBP_POOL.shutdown)
+
+VIT_INPUT_CACHE: collections.OrderedDict[tuple[str, str, str], Tensor] = (
+    collections.OrderedDict()
+)
+"""LRU cache of transformed ViT inputs, keyed by (image hash, ViT family, ViT checkpoint)."""
+
+VIT_INPUT_CACHE_SIZE = 16
+"""Maximum number of entries in `VIT_INPUT_CACHE`."""
+
+SIZED_CACHE_SIZE = 1024
+"""Maximum number of sized example images kept in memory by `get_img_v_sized`. Each is an uncompressed 448x448 RGB buffer (about 600 KB), so a full cache holds about 600 MB."""
+
+DEBUG = False
+"""Whether to run runtime type checks on functions that are called many times per request."""
+
+
+def _identity(fn):
+    return fn
+
+
+jaxtyped_beartype = jaxtyped(typechecker=beartype.beartype) if DEBUG else _identity
+"""Decorator for hot-path functions: `jaxtyped(typechecker=beartype.beartype)` if `DEBUG` is set, otherwise a no-op."""
+
 logger.info("Set global constants.")
 
 
@@ -69,7 +103,9 @@ def load_vit(
     """
     Returns the wrapped ViT, the vit transform, the activation scalar and the activation mean to normalize the activations.
     """
-    vit = activations.WrappedVisionTransformer(model_cfg.wrapped_cfg).to(DEVICE).eval()
+    vit = activations.WrappedVisionTransformer(model_cfg.wrapped_cfg)
+    drop_unused_layers(vit, model_cfg.wrapped_cfg.vit_layers)
+    vit = vit.to(DEVICE).eval()
     vit_transform = activations.make_img_transform(
         model_cfg.vit_family, model_cfg.vit_ckpt
     )
@@ -83,9 +119,28 @@ def load_vit(
         logger.warning("Error loading ViT: %s", err)
         return None, None, None, None
 
+    if DEVICE.type == "cuda":
+        # Inputs are always a single image of the same size, so CUDA graphs + fused kernels pay off. Warm up here so the first request doesn't pay the compile cost.
+        vit.forward = torch.compile(vit.forward, mode="reduce-overhead", dynamic=False)
+        x = vit_transform(PIL.Image.new("RGB", CROP_SIZE))[None, ...].to(DEVICE)
+        # Same autocast context as get_sae_activations so the warmup compiles the graph that requests actually use.
+        with torch.inference_mode(), torch.autocast("cuda", dtype=torch.bfloat16):
+            vit(x)
+        logger.info("Compiled ViT: %s.", model_cfg.key)
+
     return vit, vit_transform, acts_dataset.scalar.item(), acts_dataset.act_mean
 
 
+@beartype.beartype
+def drop_unused_layers(vit: torch.nn.Module, vit_layers: list[int]) -> None:
+    """
+    Delete every transformer block after the deepest recorded layer. The app only reads recorded activations and never the ViT's final output, so these blocks are dead weight in GPU memory. Recording hooks are attached to block modules, so the recorded layers are unaffected.
+    """
+    residuals = vit.vit.get_residuals()
+    n_keep = max(layer % len(residuals) for layer in vit_layers) + 1
+    del residuals[n_keep:]
+
+
 @beartype.beartype
 @functools.cache
 def load_sae(model_cfg: modeling.Config) -> nn.SparseAutoencoder:
@@ -93,6 +148,15 @@ def load_sae(model_cfg: modeling.Config) -> nn.SparseAutoencoder:
     sae = nn.load(sae_ckpt_fpath.as_posix())
     sae.to(DEVICE).eval()
     logger.info("Loaded SAE: %s.", model_cfg.sae_ckpt)
+
+    if DEVICE.type == "cuda":
+        sae.forward = torch.compile(sae.forward, mode="reduce-overhead", dynamic=False)
+        n_patches = model_cfg.wrapped_cfg.n_patches_per_img
+        x = torch.zeros((n_patches, sae.cfg.d_vit), device=DEVICE)
+        with torch.inference_mode():
+            sae(x)
+        logger.info("Compiled SAE: %s.", model_cfg.sae_ckpt)
+
     return sae
 
 
@@ -103,7 +167,54 @@ def load_sae(model_cfg: modeling.Config) -> nn.SparseAutoencoder:
 
 @beartype.beartype
 def load_tensor(path: str | pathlib.Path) -> Tensor:
-    return torch.load(path, weights_only=True, map_location="cpu")
+    """
+    Load a tensor saved with `torch.save` as a memory-mapped array, so only the rows we actually index get read from disk. Uses the `.npy` copy written by `convert_tensor` if it is at least as new as `path`; otherwise memory-maps `path` itself.
+    """
+    path = pathlib.Path(path)
+    npy_fpath = path.with_suffix(".npy")
+
+    if npy_fpath.exists():
+        if npy_fpath.stat().st_mtime >= path.stat().st_mtime:
+            # Copy-on-write gives torch a writeable array without ever writing back to disk.
+            return torch.from_numpy(np.load(npy_fpath, mmap_mode="c"))
+        logger.warning("'%s' is older than '%s'; ignoring it.", npy_fpath, path)
+
+    return torch.load(path, weights_only=True, map_location="cpu", mmap=True)
+
+
+@beartype.beartype
+def convert_tensor(path: str | pathlib.Path):
+    """
+    Write a tensor saved with `torch.save` to a `.npy` file next to it for `load_tensor`, unless an up-to-date one already exists.
+    """
+    path = pathlib.Path(path)
+    npy_fpath = path.with_suffix(".npy")
+    if npy_fpath.exists() and npy_fpath.stat().st_mtime >= path.stat().st_mtime:
+        return
+
+    tensor = torch.load(path, weights_only=True, map_location="cpu", mmap=True)
+    tmp_fpath = path.with_suffix(".npy.tmp")
+    try:
+        with open(tmp_fpath, "wb") as fd:
+            np.save(fd, tensor.numpy())
+        tmp_fpath.replace(npy_fpath)
+    except OSError as err:
+        tmp_fpath.unlink(missing_ok=True)
+        logger.warning("Could not write '%s': %s", npy_fpath, err)
+
+
+@beartype.beartype
+def convert_tensors():
+    """
+    Convert every model's top-k tensors with `convert_tensor`. Run once before serving requests so no request waits on the conversion.
+    """
+    for model_cfg in MODEL_LOOKUP.values():
+        for fname in ("top_img_i.pt", "top_values.pt"):
+            path = model_cfg.tensor_dpath / fname
+            if not path.exists():
+                logger.warning("Missing '%s'; skipping conversion.", path)
+                continue
+            convert_tensor(path)
 
 
 @beartype.beartype
@@ -112,8 +223,7 @@ def load_tensors(
     model_cfg: modeling.Config,
 ) -> tuple[Int[Tensor, "d_sae top_k"], Float[Tensor, "d_sae top_k n_patches"]]:
     top_img_i = load_tensor(model_cfg.tensor_dpath / "top_img_i.pt")
-    # TODO: For some reason, the top_values are about 4 times larger.
-    top_values = load_tensor(model_cfg.tensor_dpath / "top_values.pt") / 4
+    top_values = load_tensor(model_cfg.tensor_dpath / "top_values.pt")
     return top_img_i, top_values
 
 
@@ -121,13 +231,13 @@ def load_tensors(
 def get_image(example_id: str) -> list[str]:
     dataset, split, i_str = example_id.split("__")
     i = int(i_str)
-    img_v_raw, label = data.get_img_v_raw(f"{dataset}__{split}", i)
-    img_v_sized = data.to_sized(img_v_raw, RESIZE_SIZE, CROP_SIZE)
+    bufferinfo, label = get_img_v_sized(f"{dataset}__{split}", i)
+    img_v_sized = pyvips.Image.new_from_memory(*bufferinfo)
 
-    return [data.vips_to_base64(img_v_sized), label]
+    return [get_orig_url(f"{dataset}__{split}", i, img_v_sized), label]
 
 
-@jaxtyped(typechecker=beartype.beartype)
+@jaxtyped_beartype
 def add_highlights(
     img_v_sized: pyvips.Image,
     patches: np.ndarray,
@@ -161,25 +271,21 @@ def add_highlights(
     patch_h = img_v_sized.height // grid_h
     assert patch_w == patch_h
 
-    patches = np.clip(patches, a_min=0.0, a_max=upper + 1e-9)
-
     assert upper is not None
-    colors = (COLORMAP(patches / (upper + 1e-9))[:, :3] * 256).astype(np.uint8)
-
-    # Create overlay by processing each patch
-    overlay = np.zeros((img_v_sized.width, img_v_sized.height, 4), dtype=np.uint8)
-    for idx, (val, color) in enumerate(zip(patches, colors)):
-        val = val / (upper + 1e-9)
-
-        x = (idx % grid_w) * patch_w
-        y = (idx // grid_w) * patch_h
-
-        # Create patch overlay
-        patch = np.zeros((patch_w, patch_h, 4), dtype=np.uint8)
-        patch[:, :, 0:3] = color
-        patch[:, :, 3] = int(256 * val * opacity)
-        overlay[y : y + patch_h, x : x + patch_w, :] = patch
-    overlay = pyvips.Image.new_from_array(overlay).copy(interpretation="srgb")
+    values = np.clip(patches, a_min=0.0, a_max=upper + 1e-9) / (upper + 1e-9)
+    values = values.reshape(grid_h, grid_w)
+
+    # One RGBA pixel per patch. libvips zooms (pixel replication) and pads it lazily, so the full-size overlay is only ever computed tile-by-tile as part of the composite + encode pipeline.
+    overlay_grid = np.empty((grid_h, grid_w, 4), dtype=np.uint8)
+    overlay_grid[:, :, 0:3] = (COLORMAP(values)[:, :, :3] * 256).astype(np.uint8)
+    overlay_grid[:, :, 3] = (256 * values * opacity).astype(np.uint8)
+
+    overlay = (
+        pyvips.Image.new_from_array(overlay_grid)
+        .zoom(patch_w, patch_h)
+        .embed(0, 0, img_v_sized.width, img_v_sized.height)
+        .copy(interpretation="srgb")
+    )
     return img_v_sized.addalpha().composite(overlay, "over")
 
 
@@ -214,7 +320,7 @@ class SaeActivation(typing.TypedDict):
     """The index of the SAE latent being measured."""
 
     activations: list[float]
-    """The activation values of this latent across different patches. Each value represents how strongly this latent fired on a particular patch."""
+    """The activation values of this latent across different patches, rounded to four decimal places. Each value represents how strongly this latent fired on a particular patch."""
 
     highlighted_url: str
     """The image with the colormaps applied."""
@@ -223,29 +329,6 @@ class SaeActivation(typing.TypedDict):
     """Top examples for this latent."""
 
 
-@beartype.beartype
-def pil_to_vips(pil_img: PIL.Image.Image) -> pyvips.Image:
-    # Convert to numpy array
-    np_array = np.asarray(pil_img)
-    # Handle different formats
-    if np_array.ndim == 2:  # Grayscale
-        return pyvips.Image.new_from_memory(
-            np_array.tobytes(),
-            np_array.shape[1],  # width
-            np_array.shape[0],  # height
-            1,  # bands
-            "uchar",
-        )
-    else:  # RGB/RGBA
-        return pyvips.Image.new_from_memory(
-            np_array.tobytes(),
-            np_array.shape[1],  # width
-            np_array.shape[0],  # height
-            np_array.shape[2],  # bands
-            "uchar",
-        )
-
-
 @beartype.beartype
 def vips_to_pil(vips_img: PIL.Image.Image) -> PIL.Image.Image:
     # Convert to numpy array
@@ -273,6 +356,45 @@ class BufferInfo(typing.NamedTuple):
         )
 
 
+@beartype.beartype
+@functools.lru_cache(maxsize=SIZED_CACHE_SIZE)
+def get_img_v_sized(dataset_name: str, i_im: int) -> tuple[BufferInfo, str]:
+    """
+    Get a resized and cropped dataset image along with its label. Results are cached in memory and as lossless webp files under the cache directory, so examples that show up for many latents (or after a restart) skip the decode and resize.
+
+    Returns:
+        Tuple of the sized image's pixels and the classname. Pixels are returned as a `BufferInfo` rather than a `pyvips.Image` because vips images are lazy pipelines: a cached image would redo its decode and resize every time it is rendered, while a cached buffer holds the decoded pixels. (vips images are immutable, so the images built from these buffers can be shared across threads.)
+    """
+    cache_dpath = (
+        pathlib.Path(helpers.get_cache_dir())
+        / "saev-app"
+        / data.get_sized_dname(RESIZE_SIZE, CROP_SIZE)
+        / dataset_name
+    )
+    img_fpath = cache_dpath / f"{i_im}.webp"
+    label_fpath = cache_dpath / f"{i_im}.txt"
+
+    if img_fpath.exists() and label_fpath.exists():
+        img_v_sized = pyvips.Image.new_from_file(img_fpath.as_posix())
+        return BufferInfo.from_img_v(img_v_sized), label_fpath.read_text()
+
+    img_v_sized, label = data.get_img_v_sized(
+        dataset_name, i_im, RESIZE_SIZE, CROP_SIZE
+    )
+    bufferinfo = BufferInfo.from_img_v(img_v_sized)
+
+    try:
+        cache_dpath.mkdir(parents=True, exist_ok=True)
+        img_v_sized = pyvips.Image.new_from_memory(*bufferinfo)
+        img_v_sized.write_to_file(img_fpath.as_posix(), lossless=True)
+        # Written last so a partially written image is never treated as cached.
+        label_fpath.write_text(label)
+    except (OSError, pyvips.Error) as err:
+        logger.warning("Could not cache '%s': %s", img_fpath, err)
+
+    return bufferinfo, label
+
+
 @beartype.beartype
 def bufferinfo_to_base64(bufferinfo: BufferInfo) -> str:
     img_v = pyvips.Image.new_from_memory(*bufferinfo)
@@ -282,77 +404,242 @@ def bufferinfo_to_base64(bufferinfo: BufferInfo) -> str:
     return "data:image/webp;base64," + s64
 
 
+@beartype.beartype
+def get_orig_url(dataset_name: str, i_im: int, img_v_sized: pyvips.Image) -> str:
+    """
+    Get the base64 data URL for an unhighlighted example image. Reads the precomputed thumbnail if there is one and only falls back to encoding `img_v_sized` if not.
+    """
+    thumb_fpath = data.get_thumbnail_fpath(
+        THUMBS_DPATH, dataset_name, i_im, RESIZE_SIZE, CROP_SIZE
+    )
+    if thumb_fpath.exists():
+        return thumb_fpath.read_text()
+
+    return data.vips_to_base64(img_v_sized)
+
+
+@jaxtyped_beartype
+def get_highlighted_url(
+    img_v_sized: pyvips.Image, patches: np.ndarray, upper: float
+) -> str:
+    """Highlight an image with `add_highlights` and encode it as a base64 data URL."""
+    return data.vips_to_base64(add_highlights(img_v_sized, patches, upper=upper))
+
+
+@jaxtyped_beartype
+def prep_vit_input(
+    img_HWC: Int[Tensor, "height width 3"],
+    mean_C: Float[Tensor, "3"],
+    std_C: Float[Tensor, "3"],
+) -> Float[Tensor, "1 3 height width"]:
+    """
+    Scale a uint8 image to [0, 1], normalize it and move channels first, like torchvision's `ToDtype` + `Normalize`. Compiled on GPUs so the whole chain runs as one fused kernel.
+    """
+    x_HWC = (img_HWC.float() / 255.0 - mean_C) / std_C
+    return x_HWC.permute(2, 0, 1)[None, ...]
+
+
+if DEVICE.type == "cuda":
+    # Not reduce-overhead: CUDA graph replays reuse their output memory, which would overwrite inputs held in VIT_INPUT_CACHE.
+    prep_vit_input = torch.compile(prep_vit_input, dynamic=False)
+
+
+@beartype.beartype
+@functools.cache
+def get_norm_tensors(
+    mean: tuple[float, ...], std: tuple[float, ...]
+) -> tuple[Tensor, Tensor]:
+    """Normalization mean and std as tensors on `DEVICE`, made once per ViT transform."""
+    return (
+        torch.tensor(mean, dtype=torch.float32, device=DEVICE),
+        torch.tensor(std, dtype=torch.float32, device=DEVICE),
+    )
+
+
+@beartype.beartype
+class VitInputSpec(typing.NamedTuple):
+    """The resize, crop and normalization steps of a ViT's image transform."""
+
+    resize_px: int | tuple[int, int]
+    """Resize shorter side to this size in pixels if an int; otherwise resize to exactly (height, width)."""
+    crop_px: tuple[int, int]
+    """Center crop (height, width) in pixels."""
+    mean: tuple[float, ...]
+    std: tuple[float, ...]
+
+    @classmethod
+    def from_transform(cls, vit_transform: typing.Callable) -> "VitInputSpec":
+        """
+        Read the resize, crop and normalization steps out of a torchvision `Compose` like the ones from `activations.make_img_transform`.
+        """
+        resize_px, crop_px, mean, std = None, None, None, None
+        for transform in vit_transform.transforms:
+            name = type(transform).__name__
+            if name == "Resize":
+                size = transform.size
+                if isinstance(size, int):
+                    resize_px = size
+                elif len(size) == 1:
+                    resize_px = size[0]
+                else:
+                    resize_px = tuple(size)
+            elif name == "CenterCrop":
+                crop_px = tuple(transform.size)
+            elif name == "Normalize":
+                mean, std = tuple(transform.mean), tuple(transform.std)
+
+        if resize_px is None or mean is None:
+            raise ValueError(f"Unsupported ViT transform: {vit_transform}")
+
+        if crop_px is None:
+            crop_px = (
+                (resize_px, resize_px) if isinstance(resize_px, int) else resize_px
+            )
+
+        return cls(resize_px, crop_px, mean, std)
+
+
 @jaxtyped(typechecker=beartype.beartype)
+def get_vit_input(
+    model_cfg: modeling.Config, img_fpath: str, vit_transform: typing.Callable
+) -> Float[Tensor, "1 3 width height"]:
+    """
+    Load an image file as a batch of one ViT input on `DEVICE`. Several models share a ViT checkpoint, so the result is cached by file contents and checkpoint.
+
+    The image is decoded, resized and cropped with libvips (which shrinks JPEGs during decoding) and normalized on `DEVICE` with `prep_vit_input`, matching the steps of `vit_transform` without going through PIL.
+    """
+    img_hash = hashlib.blake2b(pathlib.Path(img_fpath).read_bytes(), digest_size=16)
+    key = (img_hash.hexdigest(), model_cfg.vit_family, model_cfg.vit_ckpt)
+
+    if key in VIT_INPUT_CACHE:
+        VIT_INPUT_CACHE.move_to_end(key)
+        return VIT_INPUT_CACHE[key]
+
+    spec = VitInputSpec.from_transform(vit_transform)
+    if isinstance(spec.resize_px, int):
+        # Resize shorter side to resize_px and center crop to a square.
+        img_v = pyvips.Image.thumbnail(
+            img_fpath, spec.resize_px, height=spec.resize_px, crop="centre"
+        )
+    else:
+        resize_h, resize_w = spec.resize_px
+        img_v = pyvips.Image.thumbnail(
+            img_fpath, resize_w, height=resize_h, size="force"
+        )
+
+    crop_h, crop_w = spec.crop_px
+    left = (img_v.width - crop_w) // 2
+    top = (img_v.height - crop_h) // 2
+    img_v = img_v.crop(left, top, crop_w, crop_h)
+
+    img_v = data.to_srgb(img_v)
+
+    img_HWC = torch.from_numpy(img_v.numpy())
+    if DEVICE.type == "cuda":
+        # Copy the uint8 bytes, a quarter of the size of the float input. The pinned copy comes from torch's caching host allocator, which only reuses it once the asynchronous copy has finished.
+        img_HWC = img_HWC.pin_memory().to(DEVICE, non_blocking=True)
+
+    x = prep_vit_input(img_HWC, *get_norm_tensors(spec.mean, spec.std))
+
+    VIT_INPUT_CACHE[key] = x
+    if len(VIT_INPUT_CACHE) > VIT_INPUT_CACHE_SIZE:
+        VIT_INPUT_CACHE.popitem(last=False)
+    return x
+
+
+@beartype.beartype
+class SizedExample(typing.NamedTuple):
+    """A top example image, loaded once per request and shared by every latent that uses it."""
+
+    img_v_sized: pyvips.Image
+    label: str
+    orig_future: concurrent.futures.Future
+    """Resolves to the base64 URL of the unhighlighted image."""
+
+
+@beartype.beartype
+def get_example_k(top_img_i: list[int], n_examples: int = 4) -> list[int]:
+    """
+    Pick which of a latent's top-k entries to show as examples: the first occurrence of each of the first `n_examples` unique images.
+
+    Args:
+        top_img_i: Dataset indices of the latent's top-k images, possibly with duplicates.
+        n_examples: Number of unique example images.
+
+    Returns:
+        Indices into `top_img_i`.
+    """
+    example_k, seen_i_im = [], set()
+    for k, i_im in enumerate(top_img_i):
+        if i_im in seen_i_im:
+            continue
+
+        example_k.append(k)
+        seen_i_im.add(i_im)
+
+        if len(seen_i_im) >= n_examples:
+            break
+
+    return example_k
+
+
+@jaxtyped_beartype
 def make_sae_activation(
     model_cfg: modeling.Config,
     latent: int,
     acts: Float[np.ndarray, " n_patches"],
-    img_v: pyvips.Image,
+    img_v_sized: pyvips.Image,
     top_img_i: list[int],
     top_values: Float[Tensor, "top_k n_patches"],
+    example_lookup: dict[int, SizedExample],
     pool: concurrent.futures.Executor,
 ) -> SaeActivation:
-    raw_examples: list[tuple[int, pyvips.Image, Float[np.ndarray, "..."], str]] = []
-    seen_i_im = set()
-    for i_im, values_p in zip(top_img_i, top_values):
-        if i_im in seen_i_im:
-            continue
-
-        ex_img_v_raw, ex_label = data.get_img_v_raw(model_cfg.dataset_name, i_im)
-        ex_img_v_sized = data.to_sized(ex_img_v_raw, RESIZE_SIZE, CROP_SIZE)
-        raw_examples.append((i_im, ex_img_v_sized, values_p.numpy(), ex_label))
-
-        seen_i_im.add(i_im)
-
-        # Only need 4 example images per latent.
-        if len(seen_i_im) >= 4:
-            break
-
     upper = top_values.max().item()
 
+    # Highlight the original image. Submitted first since it's needed last.
+    highlighted_future = pool.submit(get_highlighted_url, img_v_sized, acts, upper)
+
     futures = []
-    for i_im, ex_img, values_p, ex_label in raw_examples:
-        highlighted_img = add_highlights(ex_img, values_p, upper=upper)
-        # Submit both conversions to the thread pool
-        orig_future = pool.submit(data.vips_to_base64, ex_img)
-        highlight_future = pool.submit(data.vips_to_base64, highlighted_img)
-        futures.append((i_im, orig_future, highlight_future, ex_label))
+    for k in get_example_k(top_img_i):
+        i_im = top_img_i[k]
+        ex_img = example_lookup[i_im].img_v_sized
+        # Building the highlight and encoding it both happen in the pool, so one example's overlay is built while another's is encoded.
+        highlight_future = pool.submit(
+            get_highlighted_url, ex_img, top_values[k].numpy(), upper
+        )
+        futures.append((i_im, highlight_future))
 
     # Wait for all conversions to complete and build examples
     examples = []
-    for i_im, orig_future, highlight_future, ex_label in futures:
+    for i_im, highlight_future in futures:
         example = Example(
-            orig_url=orig_future.result(),
+            orig_url=example_lookup[i_im].orig_future.result(),
             highlighted_url=highlight_future.result(),
-            label=ex_label,
+            label=example_lookup[i_im].label,
             example_id=f"{model_cfg.dataset_name}__{i_im}",
         )
         examples.append(example)
 
     print(model_cfg.key, latent, top_values.max(), acts.max())
 
-    # Highlight the original image.
-    img_sized_v = data.to_sized(img_v, RESIZE_SIZE, CROP_SIZE)
-    highlighted_img = add_highlights(img_sized_v, acts, upper=upper)
-    highlighted_url = data.vips_to_base64(highlighted_img)
-
     return SaeActivation(
         model_cfg=model_cfg,
         latent=latent,
-        activations=acts.tolist(),
-        highlighted_url=highlighted_url,
+        # float32 values have long decimal representations once they're Python floats; rounding in float64 keeps the JSON small.
+        activations=acts.astype(np.float64).round(4).tolist(),
+        highlighted_url=highlighted_future.result(),
         examples=examples,
     )
 
 
-@beartype.beartype
+@jaxtyped_beartype
 @torch.inference_mode
 def get_sae_activations(
-    img_p: PIL.Image.Image, latents: dict[str, list[int]]
+    img_fpath: str, latents: dict[str, list[int]]
 ) -> dict[str, list[SaeActivation]]:
     """
     Args:
-        image: Image to get SAE activations for.
+        img_fpath: Path to the image to get SAE activations for.
         latents: A lookup from model name (string) to a list of latents to report latents for (integers).
 
     Returns:
@@ -360,52 +647,85 @@ def get_sae_activations(
     """
     logger.info("latents: %s", json.dumps(latents))
 
+    # Autorotated and converted to sRGB like get_vit_input's input, so the highlights line up and composite over three bands.
+    input_img_v_sized = data.to_srgb(
+        data.load_sized(img_fpath, RESIZE_SIZE, CROP_SIZE, autorotate=True)
+    )
+
     response = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as pool:
-        for model_name, requested_latents in latents.items():
-            sae_activations = []
-            if not requested_latents:
-                logger.warning(
-                    "Skipping ViT '%s' with no requested latents.", model_name
-                )
-                response[model_name] = sae_activations
-                continue
+    for model_name, requested_latents in latents.items():
+        sae_activations = []
+        if not requested_latents:
+            logger.warning("Skipping ViT '%s' with no requested latents.", model_name)
+            response[model_name] = sae_activations
+            continue
 
-            model_cfg = MODEL_LOOKUP[model_name]
-            vit, vit_transform, scalar, mean = load_vit(model_cfg)
-            if vit is None:
-                logger.warning("Skipping ViT '%s'", model_name)
-                continue
-            sae = load_sae(model_cfg)
+        model_cfg = MODEL_LOOKUP[model_name]
+        vit, vit_transform, scalar, mean = load_vit(model_cfg)
+        if vit is None:
+            logger.warning("Skipping ViT '%s'", model_name)
+            continue
+        sae = load_sae(model_cfg)
 
-            mean = mean.to(DEVICE)
-            x = vit_transform(img_p)[None, ...].to(DEVICE)
+        # Read the top-k tensors from disk while the ViT and SAE run.
+        tensors_future = WEBP_POOL.submit(load_tensors, model_cfg)
 
+        mean = mean.to(DEVICE)
+        x = get_vit_input(model_cfg, img_fpath, vit_transform)
+
+        # The frozen ViT runs in bfloat16 on GPUs; the SAE still gets float32 inputs.
+        with torch.autocast(
+            DEVICE.type, dtype=torch.bfloat16, enabled=DEVICE.type == "cuda"
+        ):
             _, vit_acts_BLPD = vit(x)
-            vit_acts_PD = (
-                vit_acts_BLPD[0, 0, 1:].to(DEVICE).clamp(-1e-5, 1e5) - mean
-            ) / scalar
-
-            _, f_x_PS, _ = sae(vit_acts_PD)
-            # Ignore [CLS] token and get just the requested latents.
-            acts_SP = einops.rearrange(f_x_PS, "patches n_latents -> n_latents patches")
-            logger.info("Got SAE activations for '%s'.", model_name)
-            top_img_i, top_values = load_tensors(model_cfg)
-            logger.info("Loaded top SAE activations for '%s'.", model_name)
-
-            for latent in requested_latents:
-                sae_activations.append(
-                    make_sae_activation(
-                        model_cfg,
-                        latent,
-                        acts_SP[latent].cpu().numpy(),
-                        data.pil_to_vips(img_p),
-                        top_img_i[latent].tolist(),
-                        top_values[latent],
-                        pool,
-                    )
+        vit_acts_PD = (
+            vit_acts_BLPD[0, 0, 1:].to(DEVICE).float().clamp(-1e-5, 1e5) - mean
+        ) / scalar
+
+        _, f_x_PS, _ = sae(vit_acts_PD)
+        # Ignore [CLS] token and get just the requested latents.
+        acts_SP = einops.rearrange(f_x_PS, "patches n_latents -> n_latents patches")
+        logger.info("Got SAE activations for '%s'.", model_name)
+        top_img_i, top_values = tensors_future.result()
+        logger.info("Loaded top SAE activations for '%s'.", model_name)
+
+        # Gather all requested latents at once: one device-to-host copy (and one sync) instead of one per latent.
+        acts_LP = acts_SP[requested_latents].cpu().numpy()
+        top_img_i_LK = top_img_i[requested_latents].tolist()
+        # TODO: For some reason, the top_values are about 4 times larger.
+        top_values_LKP = top_values[requested_latents] / 4
+
+        # Latents often share top examples, so load and encode each unique example image once per request.
+        example_lookup = {}
+        for top_img_i_K in top_img_i_LK:
+            for k in get_example_k(top_img_i_K):
+                i_im = top_img_i_K[k]
+                if i_im in example_lookup:
+                    continue
+
+                bufferinfo, label = get_img_v_sized(model_cfg.dataset_name, i_im)
+                ex_img_v_sized = pyvips.Image.new_from_memory(*bufferinfo)
+                orig_future = WEBP_POOL.submit(
+                    get_orig_url, model_cfg.dataset_name, i_im, ex_img_v_sized
                 )
-            response[model_name] = sae_activations
+                example_lookup[i_im] = SizedExample(ex_img_v_sized, label, orig_future)
+
+        for latent, acts_P, top_img_i_K, top_values_KP in zip(
+            requested_latents, acts_LP, top_img_i_LK, top_values_LKP
+        ):
+            sae_activations.append(
+                make_sae_activation(
+                    model_cfg,
+                    latent,
+                    acts_P,
+                    input_img_v_sized,
+                    top_img_i_K,
+                    top_values_KP,
+                    example_lookup,
+                    WEBP_POOL,
+                )
+            )
+        response[model_name] = sae_activations
     return response
 
 
@@ -488,7 +808,7 @@ with gr.Blocks() as demo:
     input_image = gr.Image(
         label="Input Image",
         sources=["upload", "clipboard"],
-        type="pil",
+        type="filepath",
         interactive=True,
     )
     get_sae_activations_btn = gr.Button(value="Get SAE Activations")
@@ -501,4 +821,5 @@ with gr.Blocks() as demo:
 
 
 if __name__ == "__main__":
+    convert_tensors()
     demo.launch()
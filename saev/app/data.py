@@ -1,15 +1,18 @@
 import base64
 import functools
+import hashlib
 import logging
+import os
+import pathlib
+import pickle
 import typing
 
 import beartype
 import pyvips
 import torch
 import torchvision.datasets
-from PIL import Image
 
-from .. import activations, config
+from .. import activations, config, helpers
 
 logger = logging.getLogger("app.data")
 
@@ -32,6 +35,37 @@ class VipsImageFolder(torchvision.datasets.ImageFolder):
             loader=self._vips_loader,
         )
 
+    def make_dataset(
+        self, directory: str, class_to_idx: dict[str, int], *args, **kwargs
+    ) -> list[tuple[str, int]]:
+        """
+        Same as `torchvision.datasets.ImageFolder.make_dataset`, but the list of samples is cached on disk. Walking every class directory of a dataset like iNat21 takes tens of seconds.
+        """
+        root_hash = hashlib.sha256(os.path.realpath(directory).encode("utf8"))
+        cache_fpath = (
+            pathlib.Path(helpers.get_cache_dir())
+            / "saev-app"
+            / f"samples-{root_hash.hexdigest()}.pkl"
+        )
+
+        if cache_fpath.is_file():
+            with open(cache_fpath, "rb") as fd:
+                cached_class_to_idx, samples = pickle.load(fd)
+            if cached_class_to_idx == class_to_idx:
+                return samples
+            logger.warning("Classes changed; ignoring cached '%s'.", cache_fpath)
+
+        samples = super().make_dataset(directory, class_to_idx, *args, **kwargs)
+
+        try:
+            cache_fpath.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_fpath, "wb") as fd:
+                pickle.dump((class_to_idx, samples), fd)
+        except OSError as err:
+            logger.warning("Could not cache '%s': %s", cache_fpath, err)
+
+        return samples
+
     @staticmethod
     def _vips_loader(path: str) -> torch.Tensor:
         """Load and convert image to tensor using pyvips."""
@@ -85,15 +119,21 @@ class VipsImagenet(activations.Imagenet):
 
 
 @functools.cache
-def get_datasets():
-    datasets = {
-        "inat21__train_mini": VipsImageFolder(
+def get_dataset(key: str) -> VipsImageFolder | VipsImagenet:
+    """
+    Construct a dataset on first use. Only the requested dataset is built, since building one can be slow.
+    """
+    if key == "inat21__train_mini":
+        dataset = VipsImageFolder(
             root="/research/nfs_su_809/workspace/stevens.994/datasets/inat21/train_mini/"
-        ),
-        "imagenet__train": VipsImagenet(config.ImagenetDataset()),
-    }
-    logger.info("Loaded datasets.")
-    return datasets
+        )
+    elif key == "imagenet__train":
+        dataset = VipsImagenet(config.ImagenetDataset())
+    else:
+        raise ValueError(f"Unknown dataset '{key}'.")
+
+    logger.info("Loaded dataset '%s'.", key)
+    return dataset
 
 
 @beartype.beartype
@@ -104,11 +144,34 @@ def get_img_v_raw(key: str, i: int) -> tuple[pyvips.Image, str]:
     Returns:
         Tuple of pyvips.Image and classname.
     """
-    dataset = get_datasets()[key]
+    dataset = get_dataset(key)
     sample = dataset[i]
+    return sample["image"], get_label(sample["label"])
+
+
+@beartype.beartype
+def get_img_v_sized(
+    key: str, i: int, min_px: int, crop_px: tuple[int, int]
+) -> tuple[pyvips.Image, str]:
+    """
+    Get an image at standard model input size (see `to_sized`) and processed label from dataset. Images stored as files are loaded with `load_sized`, which avoids decoding the full-resolution image.
+
+    Returns:
+        Tuple of pyvips.Image and classname.
+    """
+    dataset = get_dataset(key)
+    if isinstance(dataset, VipsImageFolder):
+        fpath, target = dataset.samples[i]
+        return load_sized(fpath, min_px, crop_px), get_label(dataset.classes[target])
+
+    img_v_raw, label = get_img_v_raw(key, i)
+    return to_sized(img_v_raw, min_px, crop_px), label
+
+
+@beartype.beartype
+def get_label(classname: str) -> str:
     # iNat21 specific: Remove taxonomy prefix
-    label = " ".join(sample["label"].split("_")[1:])
-    return sample["image"], label
+    return " ".join(classname.split("_")[1:])
 
 
 def to_sized(
@@ -131,19 +194,36 @@ def to_sized(
 
 
 @beartype.beartype
-def pil_to_vips(img_p: Image.Image) -> pyvips.Image:
-    """Convert a PIL Image to a pyvips Image."""
-    # Convert PIL image to bytes
-    img_bytes = img_p.tobytes()
-    # Create new pyvips image from memory buffer
-    return pyvips.Image.new_from_memory(
-        img_bytes,
-        img_p.width,
-        img_p.height,
-        len(img_p.getbands()),  # Number of bands (channels)
-        "uchar",  # 8-bit unsigned data
+def load_sized(
+    fpath: str, min_px: int, crop_px: tuple[int, int], *, autorotate: bool = False
+) -> pyvips.Image:
+    """
+    Load an image file at standard model input size. libvips' thumbnail shrinks JPEGs during decoding (DCT scaling), so most of the pixels that the resize would throw away are never decoded.
+
+    By default the EXIF orientation is ignored, like the PIL and `new_from_file` loaders used to compute activations, so the result matches `to_sized` and patch highlights line up. Pass `autorotate=True` for images whose ViT input was also loaded with autorotation, such as uploads in `get_vit_input`.
+    """
+    # Resize so the smallest dimension = min_px and center crop to a min_px square.
+    img_v = pyvips.Image.thumbnail(
+        fpath, min_px, height=min_px, crop="centre", no_rotate=not autorotate
     )
 
+    # Calculate crop coordinates to center crop
+    left = (img_v.width - crop_px[0]) // 2
+    top = (img_v.height - crop_px[1]) // 2
+
+    # Crop to final size
+    return img_v.crop(left, top, crop_px[0], crop_px[1])
+
+
+@beartype.beartype
+def to_srgb(img_v: pyvips.Image) -> pyvips.Image:
+    """
+    Convert an uploaded image to three-band sRGB: transparent pixels are flattened onto black and greyscale or CMYK images are converted, like PIL's `convert("RGB")`.
+    """
+    if img_v.hasalpha():
+        img_v = img_v.flatten()
+    return img_v.colourspace("srgb")
+
 
 @beartype.beartype
 def vips_to_base64(img_v: pyvips.Image) -> str:
@@ -151,3 +231,58 @@ def vips_to_base64(img_v: pyvips.Image) -> str:
     b64 = base64.b64encode(buf)
     s64 = b64.decode("utf8")
     return "data:image/webp;base64," + s64
+
+
+@beartype.beartype
+def get_sized_dname(min_px: int, crop_px: tuple[int, int]) -> str:
+    """
+    Directory name for cached images made by `get_img_v_sized` with these settings. "norotate" marks images loaded without EXIF rotation, so files cached with other settings (or before that change) are never reused.
+    """
+    return f"sized-norotate-{min_px}-{crop_px[0]}x{crop_px[1]}"
+
+
+@beartype.beartype
+def get_thumbnail_fpath(
+    dump_to: pathlib.Path, key: str, i: int, min_px: int, crop_px: tuple[int, int]
+) -> pathlib.Path:
+    """Where the precomputed base64 thumbnail for image `i` of dataset `key` at these size settings lives."""
+    return dump_to / get_sized_dname(min_px, crop_px) / key / f"{i}.b64"
+
+
+@beartype.beartype
+def precompute_thumbnails(
+    key: str,
+    *,
+    dump_to: pathlib.Path = pathlib.Path("thumbs"),
+    min_px: int = 512,
+    crop_px: tuple[int, int] = (448, 448),
+):
+    """
+    Resize, crop and encode every image in a dataset as a base64 webp data URL, one file per image. The app serves original example images from these files rather than encoding them on every request.
+
+    Existing files are skipped, so this is safe to re-run if it is interrupted.
+
+    Args:
+        key: Which dataset to use, like 'inat21__train_mini'.
+        dump_to: Root directory for thumbnails.
+        min_px: Resize shorter side to this size in pixels. The app only uses thumbnails made with its `RESIZE_SIZE`.
+        crop_px: Crop size in pixels. The app only uses thumbnails made with its `CROP_SIZE`.
+    """
+    (dump_to / get_sized_dname(min_px, crop_px) / key).mkdir(
+        parents=True, exist_ok=True
+    )
+    dataset = get_dataset(key)
+
+    for i in helpers.progress(range(len(dataset)), every=10_000, desc="thumbnails"):
+        thumb_fpath = get_thumbnail_fpath(dump_to, key, i, min_px, crop_px)
+        if thumb_fpath.exists():
+            continue
+
+        img_v_sized, _ = get_img_v_sized(key, i, min_px, crop_px)
+        thumb_fpath.write_text(vips_to_base64(img_v_sized))
+
+
+if __name__ == "__main__":
+    import tyro
+
+    tyro.cli(precompute_thumbnails)
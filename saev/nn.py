@@ -72,14 +72,7 @@ class SparseAutoencoder(torch.nn.Module):
             x: a batch of ViT activations.
         """
 
-        # Remove encoder bias as per Anthropic
-        h_pre = (
-            einops.einsum(
-                x - self.b_dec, self.W_enc, "... d_vit, d_vit d_sae -> ... d_sae"
-            )
-            + self.b_enc
-        )
-        f_x = torch.nn.functional.relu(h_pre)
+        f_x = self.encode(x)
         x_hat = self.decode(f_x)
 
         # Some values of x and x_hat can be very large. We can calculate a safe MSE
@@ -94,6 +87,22 @@ class SparseAutoencoder(torch.nn.Module):
 
         return x_hat, f_x, Loss(mse_loss, sparsity_loss, ghost_loss, l0, l1)
 
+    def encode(self, x: Float[Tensor, "batch d_model"]) -> Float[Tensor, "batch d_sae"]:
+        """
+        Calculates only the intermediate activations f_x, skipping the reconstruction and loss.
+
+        Arguments:
+            x: a batch of ViT activations.
+        """
+        # Remove encoder bias as per Anthropic
+        h_pre = (
+            einops.einsum(
+                x - self.b_dec, self.W_enc, "... d_vit, d_vit d_sae -> ... d_sae"
+            )
+            + self.b_enc
+        )
+        return torch.nn.functional.relu(h_pre)
+
     def decode(
         self, f_x: Float[Tensor, "batch d_sae"]
     ) -> Float[Tensor, "batch d_model"]:
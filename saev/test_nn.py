@@ -9,7 +9,7 @@ import torch
 from jaxtyping import Float
 from torch import Tensor
 
-from . import nn
+from . import config, nn
 
 
 def test_safe_mse_same():
@@ -47,6 +47,13 @@ def test_safe_mse_large_x():
     assert not safe.isnan().any()
 
 
+def test_encode_matches_forward():
+    sae = nn.SparseAutoencoder(config.SparseAutoencoder(d_vit=8, exp_factor=2))
+    x = torch.randn((5, 8))
+    _, f_x, _ = sae(x)
+    torch.testing.assert_close(sae.encode(x), f_x)
+
+
 @pytest.mark.slow
 @hypothesis.settings(suppress_health_check=[hypothesis.HealthCheck.too_slow])
 @hypothesis.given(
@@ -16,3 +16,79 @@ def test_gather_batched_small():
     ]).float()
 
     torch.testing.assert_close(actual, expected)
+
+
+def test_update_topk_matches_topk():
+    d_sae, k, n_batches, batch_size = 6, 3, 4, 10
+    acts = torch.rand((n_batches * batch_size, d_sae))
+
+    top_values = torch.empty((d_sae, 2 * k))
+    top_i = torch.empty((d_sae, 2 * k), dtype=torch.int)
+    for b in range(n_batches):
+        batch = acts[b * batch_size : (b + 1) * batch_size]
+        values, i = torch.topk(batch, k=k, dim=0)
+        visuals.update_topk(
+            top_values, top_i, values.T, (i.T + b * batch_size).int(), first=b == 0
+        )
+
+    expected_values, expected_i = torch.topk(acts, k=k, dim=0)
+    torch.testing.assert_close(top_values[:, :k], expected_values.T)
+    torch.testing.assert_close(top_i[:, :k], expected_i.T.int())
+
+
+def test_update_topk_first_batch_seeds():
+    values = torch.tensor([[3.0, 2.0], [5.0, 1.0]])
+    i = torch.tensor([[7, 8], [9, 10]], dtype=torch.int)
+    top_values = torch.full((2, 4), float("nan"))
+    top_i = torch.full((2, 4), -1, dtype=torch.int)
+
+    visuals.update_topk(top_values, top_i, values, i, first=True)
+
+    torch.testing.assert_close(top_values[:, :2], values)
+    torch.testing.assert_close(top_i[:, :2], i)
+
+
+def test_update_topk_patches():
+    top_values = torch.zeros((1, 4, 2))
+    top_i = torch.zeros((1, 4), dtype=torch.int)
+    visuals.update_topk(
+        top_values,
+        top_i,
+        torch.tensor([[[1.0, 4.0], [2.0, 0.0]]]),
+        torch.tensor([[0, 1]], dtype=torch.int),
+        first=True,
+    )
+    visuals.update_topk(
+        top_values,
+        top_i,
+        torch.tensor([[[3.0, 3.0], [0.0, 1.0]]]),
+        torch.tensor([[2, 3]], dtype=torch.int),
+        first=False,
+    )
+
+    # Ranked by max over patches: image 0 (4.0), then image 2 (3.0).
+    torch.testing.assert_close(
+        top_values[:, :2], torch.tensor([[[1.0, 4.0], [3.0, 3.0]]])
+    )
+    torch.testing.assert_close(top_i[:, :2], torch.tensor([[0, 2]], dtype=torch.int))
+
+
+def test_accumulate_stats_bf16():
+    sae_acts_BS = torch.tensor([[0.0, 1.5], [2.0, 0.0], [0.5, 0.5]]).bfloat16()
+    mean_values_S = torch.zeros(2)
+    sparsity_S = torch.zeros(2)
+    distributions_MN = torch.zeros((1, 5))
+
+    visuals.accumulate_stats(
+        sae_acts_BS,
+        torch.tensor([4, 0, 2]),
+        mean_values_S,
+        sparsity_S,
+        distributions_MN,
+    )
+
+    torch.testing.assert_close(mean_values_S, torch.tensor([2.5, 2.0]))
+    torch.testing.assert_close(sparsity_S, torch.tensor([2.0, 2.0]))
+    torch.testing.assert_close(
+        distributions_MN, torch.tensor([[2.0, 0.0, 0.5, 0.0, 0.0]])
+    )
@@ -5,6 +5,7 @@ Variables suffixed with `_im` refer to entire images, and variables suffixed wit
 """
 
 import collections.abc
+import concurrent.futures
 import dataclasses
 import json
 import logging
@@ -68,6 +69,24 @@ def make_img(elem: GridElement, *, upper: float | None = None) -> Image.Image:
     return img
 
 
+@beartype.beartype
+def save_img(elem: GridElement, img_fpath: str, *, upper: float | None = None):
+    """
+    Highlight an element with `make_img` and save it as a PNG, with its label in a `.txt` file next to it.
+
+    Args:
+        elem: Image, label and patch values.
+        img_fpath: Where to save the PNG.
+        upper: Value to scale patch highlights by.
+    """
+    img = make_img(elem, upper=upper)
+    # Fast, light compression; zlib time dominates otherwise.
+    img.save(img_fpath, compress_level=1)
+    label_fpath = os.path.splitext(img_fpath)[0] + ".txt"
+    with open(label_fpath, "w") as fd:
+        fd.write(elem.label + "\n")
+
+
 @jaxtyped(typechecker=beartype.beartype)
 def get_new_topk(
     val1: Float[Tensor, "d_sae k"],
@@ -97,6 +116,45 @@ def get_new_topk(
     return new_values, new_indices
 
 
+@jaxtyped(typechecker=beartype.beartype)
+def update_topk(
+    top_values: Float[Tensor, "d_sae two_k *patches"],
+    top_i: Int[Tensor, "d_sae two_k"],
+    new_values: Float[Tensor, "d_sae k *patches"],
+    new_i: Int[Tensor, "d_sae k"],
+    *,
+    first: bool,
+):
+    """
+    Merge a batch's top k into running top-k buffers, in place.
+
+    The buffers have room for 2k entries per latent. The left half holds the running top k; the batch's candidates are written into the right half, and the best k of both halves are copied back into the left half. The first batch has nothing to merge with, so it seeds the left half directly.
+
+    Args:
+        top_values: Running top-k buffer of values. If it has a trailing patch dimension, entries are ranked by their max over patches.
+        top_i: Running top-k buffer of image indices.
+        new_values: The batch's top-k candidate values.
+        new_i: The image indices of those candidates.
+        first: Whether this is the first batch.
+    """
+    _, k = new_i.shape
+    if first:
+        top_values[:, :k].copy_(new_values)
+        top_i[:, :k].copy_(new_i)
+        return
+
+    top_values[:, k:].copy_(new_values)
+    top_i[:, k:].copy_(new_i)
+
+    if top_values.ndim == 2:
+        _, i = torch.topk(top_values, k=k, dim=1)
+        top_values[:, :k].copy_(torch.gather(top_values, 1, i))
+    else:
+        _, i = torch.topk(top_values.max(dim=-1).values, k=k, dim=1)
+        top_values[:, :k].copy_(gather_batched(top_values, i))
+    top_i[:, :k].copy_(torch.gather(top_i, 1, i))
+
+
 @beartype.beartype
 def batched_idx(
     total_size: int, batch_size: int
@@ -116,9 +174,62 @@ def batched_idx(
         yield start, stop
 
 
+@beartype.beartype
+def make_sae_acts_buffer(
+    n: int, sae: nn.SparseAutoencoder, cfg: config.Visuals
+) -> Tensor:
+    """Allocate an `(n, d_sae)` buffer on `cfg.device` for `get_sae_acts` to fill."""
+    dtype = torch.bfloat16 if cfg.device == "cuda" else torch.float32
+    return torch.empty((n, sae.cfg.d_sae), dtype=dtype, device=cfg.device)
+
+
+@beartype.beartype
+def compile_sae_encode(sae: nn.SparseAutoencoder, cfg: config.Visuals):
+    """
+    On CUDA, replace `sae.encode` with a compiled version that fuses the encoder matmul, bias and ReLU and replays them as a CUDA graph. `get_sae_acts` only runs the encoder, never the decoder or loss.
+
+    CUDA graph replays reuse their output memory, which is safe because `get_sae_acts` copies each output into its buffer right away.
+    """
+    if cfg.device != "cuda":
+        return
+    sae.encode = torch.compile(sae.encode, mode="reduce-overhead", dynamic=False)
+
+
+@jaxtyped(typechecker=beartype.beartype)
+def accumulate_stats(
+    sae_acts_BS: Float[Tensor, "batch d_sae"],
+    image_i_B: Int[Tensor, " batch"],
+    mean_values_S: Float[Tensor, " d_sae"],
+    sparsity_S: Float[Tensor, " d_sae"],
+    distributions_MN: Float[Tensor, "m n"],
+):
+    """
+    Add a batch of SAE activations to the running per-latent sums, counts of active examples and activation distributions, in place.
+
+    Reductions run over the batch in the (batch, d_sae) layout; transposing the whole batch first would copy it.
+
+    Args:
+        sae_acts_BS: Batch of SAE activations, possibly in bfloat16.
+        image_i_B: Dataset image index of each activation.
+        mean_values_S: Running sum of activations per latent; accumulated in float32.
+        sparsity_S: Running count of positive activations per latent.
+        distributions_MN: Activations of the first m latents for every example.
+    """
+    m, _ = distributions_MN.shape
+    distributions_MN[:, image_i_B] = sae_acts_BS[:, :m].T.to("cpu", torch.float32)
+
+    mean_values_S += sae_acts_BS.sum(dim=0, dtype=torch.float32)
+    # SAE activations are non-negative, so counting nonzeros counts positives without a boolean intermediate.
+    sparsity_S += torch.count_nonzero(sae_acts_BS, dim=0)
+
+
 @jaxtyped(typechecker=beartype.beartype)
 def get_sae_acts(
-    vit_acts: Float[Tensor, "n d_vit"], sae: nn.SparseAutoencoder, cfg: config.Visuals
+    vit_acts: Float[Tensor, "n d_vit"],
+    sae: nn.SparseAutoencoder,
+    cfg: config.Visuals,
+    *,
+    out: Float[Tensor, "max_n d_sae"] | None = None,
 ) -> Float[Tensor, "n d_sae"]:
     """
     Get SAE hidden layer activations for a batch of ViT activations.
@@ -127,14 +238,22 @@ def get_sae_acts(
         vit_acts: Batch of ViT activations
         sae: Sparse autoencder.
         cfg: Experimental config.
+        out: Optional buffer from `make_sae_acts_buffer` with at least `n` rows to write activations into. Reusing one buffer across batches keeps the caching allocator in a steady state.
+
+    Returns:
+        SAE activations in bfloat16 on CUDA (top-k selection and sums over them are memory-bound), otherwise in float32.
     """
-    sae_acts = []
-    for start, end in batched_idx(len(vit_acts), cfg.sae_batch_size):
-        _, f_x, *_ = sae(vit_acts[start:end].to(cfg.device))
-        sae_acts.append(f_x)
+    use_bf16 = cfg.device == "cuda"
+    # Fill a preallocated buffer instead of concatenating a list of batches, which would allocate and copy everything a second time.
+    if out is None:
+        out = make_sae_acts_buffer(len(vit_acts), sae, cfg)
+    sae_acts = out[: len(vit_acts)]
+    # One copy for the whole batch rather than one per minibatch; a no-op if vit_acts is already on cfg.device.
+    vit_acts = vit_acts.to(cfg.device, non_blocking=True)
+    with torch.autocast("cuda", dtype=torch.bfloat16, enabled=use_bf16):
+        for start, end in batched_idx(len(vit_acts), cfg.sae_batch_size):
+            sae_acts[start:end].copy_(sae.encode(vit_acts[start:end]))
 
-    sae_acts = torch.cat(sae_acts, dim=0)
-    sae_acts = sae_acts.to(cfg.device)
     return sae_acts
 
 
@@ -173,11 +292,15 @@ def get_topk_img(cfg: config.Visuals) -> TopKImg:
     assert cfg.data.patches == "cls"
 
     sae = nn.load(cfg.ckpt).to(cfg.device)
+    compile_sae_encode(sae, cfg)
     dataset = activations.Dataset(cfg.data)
 
-    top_values_im_SK = torch.full((sae.cfg.d_sae, cfg.top_k), -1.0, device=cfg.device)
-    top_i_im_SK = torch.zeros(
-        (sae.cfg.d_sae, cfg.top_k), dtype=torch.int, device=cfg.device
+    # Running top-k buffers for update_topk. The fill values are only returned if there are no batches.
+    top_values_im_S2K = torch.full(
+        (sae.cfg.d_sae, 2 * cfg.top_k), -1.0, device=cfg.device
+    )
+    top_i_im_S2K = torch.zeros(
+        (sae.cfg.d_sae, 2 * cfg.top_k), dtype=torch.int, device=cfg.device
     )
     sparsity_S = torch.zeros((sae.cfg.d_sae,), device=cfg.device)
     mean_values_S = torch.zeros((sae.cfg.d_sae,), device=cfg.device)
@@ -193,39 +316,43 @@ def get_topk_img(cfg: config.Visuals) -> TopKImg:
         shuffle=False,
         num_workers=cfg.n_workers,
         drop_last=False,
+        pin_memory=cfg.device == "cuda",
     )
 
+    sae_acts_buf = make_sae_acts_buffer(cfg.topk_batch_size, sae, cfg)
     logger.info("Loaded SAE and data.")
 
-    for batch in helpers.progress(dataloader, desc="picking top-k"):
+    for b, batch in enumerate(helpers.progress(dataloader, desc="picking top-k")):
         vit_acts_BD = batch["act"]
-        sae_acts_BS = get_sae_acts(vit_acts_BD, sae, cfg)
+        sae_acts_BS = get_sae_acts(vit_acts_BD, sae, cfg, out=sae_acts_buf)
 
         for sae_act_S in sae_acts_BS:
             estimator.update(sae_act_S)
 
-        sae_acts_SB = einops.rearrange(sae_acts_BS, "batch d_sae -> d_sae batch")
-        distributions_MN[:, batch["image_i"]] = sae_acts_SB[: cfg.n_distributions].to(
-            "cpu"
+        accumulate_stats(
+            sae_acts_BS,
+            batch["image_i"],
+            mean_values_S,
+            sparsity_S,
+            distributions_MN,
         )
 
-        mean_values_S += einops.reduce(sae_acts_SB, "d_sae batch -> d_sae", "sum")
-        sparsity_S += einops.reduce((sae_acts_SB > 0), "d_sae batch -> d_sae", "sum")
-
-        sae_acts_SK, k = torch.topk(sae_acts_SB, k=cfg.top_k, dim=1)
-        i_im_SK = batch["image_i"].to(cfg.device)[k]
-
-        all_values_im_2SK = torch.cat((top_values_im_SK, sae_acts_SK), axis=1)
-
-        top_values_im_SK, k = torch.topk(all_values_im_2SK, k=cfg.top_k, axis=1)
-        top_i_im_SK = torch.gather(torch.cat((top_i_im_SK, i_im_SK), axis=1), 1, k)
+        # A long batch dimension with a small k; torch>=2.4 dispatches this to a single-block radix select, which beats a full sort.
+        sae_acts_KS, k_KS = torch.topk(sae_acts_BS, k=cfg.top_k, dim=0)
+        update_topk(
+            top_values_im_S2K,
+            top_i_im_S2K,
+            sae_acts_KS.T,
+            batch["image_i"].to(cfg.device)[k_KS.T],
+            first=b == 0,
+        )
 
     mean_values_S /= sparsity_S
     sparsity_S /= len(dataset)
 
     return TopKImg(
-        top_values_im_SK,
-        top_i_im_SK,
+        top_values_im_S2K[:, : cfg.top_k].clone(),
+        top_i_im_S2K[:, : cfg.top_k].clone(),
         mean_values_S,
         sparsity_S,
         distributions_MN,
@@ -267,15 +394,17 @@ def get_topk_patch(cfg: config.Visuals) -> TopKPatch:
     assert cfg.data.patches == "patches"
 
     sae = nn.load(cfg.ckpt).to(cfg.device)
+    compile_sae_encode(sae, cfg)
     dataset = activations.Dataset(cfg.data)
 
+    # Running top-k buffers for update_topk. The fill values are only returned if there are no batches.
     top_values_p = torch.full(
-        (sae.cfg.d_sae, cfg.top_k, dataset.metadata.n_patches_per_img),
+        (sae.cfg.d_sae, 2 * cfg.top_k, dataset.metadata.n_patches_per_img),
         -1.0,
         device=cfg.device,
     )
     top_i_im = torch.zeros(
-        (sae.cfg.d_sae, cfg.top_k), dtype=torch.int, device=cfg.device
+        (sae.cfg.d_sae, 2 * cfg.top_k), dtype=torch.int, device=cfg.device
     )
 
     sparsity_S = torch.zeros((sae.cfg.d_sae,), device=cfg.device)
@@ -300,52 +429,55 @@ def get_topk_patch(cfg: config.Visuals) -> TopKPatch:
         num_workers=cfg.n_workers,
         # See if you can change this to false and still pass the beartype check.
         drop_last=True,
+        pin_memory=cfg.device == "cuda",
     )
 
+    sae_acts_buf = make_sae_acts_buffer(batch_size, sae, cfg)
     logger.info("Loaded SAE and data.")
 
-    for batch in helpers.progress(dataloader, desc="picking top-k"):
+    for b, batch in enumerate(helpers.progress(dataloader, desc="picking top-k")):
         vit_acts_BD = batch["act"]
-        sae_acts_BS = get_sae_acts(vit_acts_BD, sae, cfg)
+        sae_acts_BS = get_sae_acts(vit_acts_BD, sae, cfg, out=sae_acts_buf)
 
         for sae_act_S in sae_acts_BS:
             estimator.update(sae_act_S)
 
-        sae_acts_SB = einops.rearrange(sae_acts_BS, "batch d_sae -> d_sae batch")
-        distributions_MN[:, batch["image_i"]] = sae_acts_SB[: cfg.n_distributions].to(
-            "cpu"
+        accumulate_stats(
+            sae_acts_BS,
+            batch["image_i"],
+            mean_values_S,
+            sparsity_S,
+            distributions_MN,
         )
 
-        mean_values_S += einops.reduce(sae_acts_SB, "d_sae batch -> d_sae", "sum")
-        sparsity_S += einops.reduce((sae_acts_SB > 0), "d_sae batch -> d_sae", "sum")
-
         i_im = torch.sort(torch.unique(batch["image_i"])).values
-        values_p = sae_acts_SB.view(
-            sae.cfg.d_sae, len(i_im), dataset.metadata.n_patches_per_img
+        values_p = einops.rearrange(
+            sae_acts_BS,
+            "(n_img n_patch) d_sae -> d_sae n_img n_patch",
+            n_patch=dataset.metadata.n_patches_per_img,
         )
 
         # Checks that I did my reshaping correctly.
         assert values_p.shape[1] == i_im.shape[0]
         assert len(i_im) == n_imgs_per_batch
 
-        _, k = torch.topk(sae_acts_SB, k=cfg.top_k, dim=1)
-        k_im = k // dataset.metadata.n_patches_per_img
-
-        values_p = gather_batched(values_p, k_im)
-        i_im = i_im.to(cfg.device)[k_im]
+        _, k_KS = torch.topk(sae_acts_BS, k=cfg.top_k, dim=0)
+        k_im = k_KS.T // dataset.metadata.n_patches_per_img
 
-        all_values_p = torch.cat((top_values_p, values_p), axis=1)
-        _, k = torch.topk(all_values_p.max(axis=-1).values, k=cfg.top_k, axis=1)
-
-        top_values_p = gather_batched(all_values_p, k)
-        top_i_im = torch.gather(torch.cat((top_i_im, i_im), axis=1), 1, k)
+        update_topk(
+            top_values_p,
+            top_i_im,
+            gather_batched(values_p, k_im),
+            i_im.to(cfg.device)[k_im],
+            first=b == 0,
+        )
 
     mean_values_S /= sparsity_S
     sparsity_S /= len(dataset)
 
     return TopKPatch(
-        top_values_p,
-        top_i_im,
+        top_values_p[:, : cfg.top_k].clone(),
+        top_i_im[:, : cfg.top_k].clone(),
         mean_values_S,
         sparsity_S,
         distributions_MN,
@@ -496,47 +628,78 @@ def main(cfg: config.Visuals):
     random.shuffle(random_neurons)
     neurons += random_neurons[: cfg.n_latents]
 
-    for i in helpers.progress(neurons, desc="saving visuals"):
-        neuron_dir = os.path.join(cfg.root, "neurons", str(i))
-        os.makedirs(neuron_dir, exist_ok=True)
-
-        # Image grid
-        elems = []
-        seen_i_im = set()
-        for i_im, values_p in zip(top_i[i].tolist(), top_values[i]):
-            if i_im in seen_i_im:
-                continue
-
-            example = dataset[i_im]
-            if cfg.sort_by == "img":
-                elem = GridElement(example["image"], example["label"], torch.tensor([]))
-            elif cfg.sort_by == "patch":
-                elem = GridElement(example["image"], example["label"], values_p)
-            else:
-                typing.assert_never(cfg.sort_by)
-            elems.append(elem)
-
-            seen_i_im.add(i_im)
-
-        # How to scale values.
-        upper = None
-        if top_values[i].numel() > 0:
-            upper = top_values[i].max().item()
-
-        for j, elem in enumerate(elems):
-            img = make_img(elem, upper=upper)
-            img.save(os.path.join(neuron_dir, f"{j}.png"))
-            with open(os.path.join(neuron_dir, f"{j}.txt"), "w") as fd:
-                fd.write(elem.label + "\n")
-
-        # Metadata
-        metadata = {
-            "neuron": i,
-            "log10_freq": torch.log10(sparsity[i]).item(),
-            "log10_value": torch.log10(mean_values[i]).item(),
-        }
-        with open(os.path.join(neuron_dir, "metadata.json"), "w") as fd:
-            json.dump(metadata, fd)
+    # One conversion for every selected latent instead of a .tolist() per latent.
+    top_i_im = dict(zip(neurons, top_i[neurons].tolist()))
+
+    # Latents often share top images, so load each image once and drop it after its last use.
+    n_uses = collections.Counter(i_im for i in neurons for i_im in set(top_i_im[i]))
+    examples = {}
+
+    # Convert per-latent scalars to Python floats in one pass each rather than with an .item() per latent.
+    uppers = [None] * d_sae
+    if top_values[0].numel() > 0:
+        uppers = top_values.reshape(d_sae, -1).max(dim=1).values.tolist()
+    log10_freqs = torch.log10(sparsity).tolist()
+    log10_values = torch.log10(mean_values).tolist()
+
+    # Create every latent's directory up front so the loop and the worker threads never touch the directory tree.
+    for i in set(neurons):
+        os.makedirs(os.path.join(cfg.root, "neurons", str(i)), exist_ok=True)
+
+    # Pillow releases the GIL while resizing and encoding, so threads scale across cores.
+    n_threads = max(cfg.n_workers, 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as pool:
+        futures = collections.deque()
+
+        for i in helpers.progress(neurons, desc="saving visuals"):
+            neuron_dir = os.path.join(cfg.root, "neurons", str(i))
+
+            # Image grid
+            elems = []
+            seen_i_im = set()
+            for i_im, values_p in zip(top_i_im[i], top_values[i]):
+                if i_im in seen_i_im:
+                    continue
+
+                if i_im not in examples:
+                    examples[i_im] = dataset[i_im]
+                example = examples[i_im]
+                n_uses[i_im] -= 1
+                if n_uses[i_im] == 0:
+                    del examples[i_im]
+
+                if cfg.sort_by == "img":
+                    elem = GridElement(
+                        example["image"], example["label"], torch.tensor([])
+                    )
+                elif cfg.sort_by == "patch":
+                    elem = GridElement(example["image"], example["label"], values_p)
+                else:
+                    typing.assert_never(cfg.sort_by)
+                elems.append(elem)
+
+                seen_i_im.add(i_im)
+
+            for j, elem in enumerate(elems):
+                img_fpath = os.path.join(neuron_dir, f"{j}.png")
+                # Scale values by the latent's largest top-k value.
+                futures.append(pool.submit(save_img, elem, img_fpath, upper=uppers[i]))
+
+            # Bound how many loaded images wait in the queue; result() re-raises any exception from the worker thread.
+            while len(futures) > 4 * n_threads:
+                futures.popleft().result()
+
+            # Metadata
+            metadata = {
+                "neuron": i,
+                "log10_freq": log10_freqs[i],
+                "log10_value": log10_values[i],
+            }
+            with open(os.path.join(neuron_dir, "metadata.json"), "w") as fd:
+                json.dump(metadata, fd)
+
+        for future in futures:
+            future.result()
 
 
 @beartype.beartype